@@ -3,22 +3,56 @@
 from __future__ import annotations
 
 import argparse
-import copy
+import functools
+import importlib.util
 import json
+import math
+import mmap
+import multiprocessing
+import multiprocessing.util
 import os
 import re
+import shutil
 import subprocess
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
-from dataclasses import dataclass
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Optional, Sequence
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
 
 import fitz  # PyMuPDF
 import google.generativeai as genai
+from google.generativeai.client import get_default_file_client
 from pypdf import PdfReader, PdfWriter
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 ROOT = Path(__file__).resolve().parent
 DOTENV = ROOT / ".env"
+# Rough peak RSS of one render process holding a 300 DPI half-page pixmap.
+RENDER_MEMORY_PER_WORKER = 512 * 1024 * 1024
+# Per-PDF NDJSON log of Gemini answers, see `append_result`.
+RESULTS_LOG_SUFFIX = "_results.jsonl"  # after the PDF stem, like the per-half JSONs
+# Adaptive OCR render resolution, see `_choose_dpi`.
+OCR_DPI_MIN = 200
+OCR_DPI_MAX = 300
+SMALL_PRINT_PT = 9.0
+OCR_MAX_PIXELS = 2480 * 3508  # A4 at 300 DPI
+# Only span sizes are read, so skip copying the bytes of every image block.
+TEXT_SIZE_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+# Per-process cache of open source PDFs, installed by `_init_renderer` in render workers.
+_DOC_CACHE = None
+# Per-process Yomitoku analyzer, created once by `_init_yomitoku` in OCR workers.
+_ANALYZER = None
+# Per-process state of PDF workers, created once by `_init_pdf_worker`.
+_MODEL = None
+_PROMPT_FILE = None
+_OCR_POOL: Optional[ProcessPoolExecutor] = None
+_RENDER_POOL: Optional[ProcessPoolExecutor] = None
 
 
 @dataclass
@@ -32,32 +66,48 @@ class Config:
     yomitoku_cmd: Path
     max_workers: int = 4
     max_page_workers: int = 4
+    ocr_dpi: Optional[int] = None  # None: chosen per page by `_choose_dpi`
+    split_results: bool = True  # False: leave the answers in <stem>_results.jsonl only
 
 
 @dataclass
-class HalfPage:
-    page_index: int
-    side: str  # l / r
-    pdf_path: Path
-    image_path: Path
+class HalfPageBatch:
+    """Every half page of one PDF, stored column-wise; index `i` is one half."""
+
+    page_indices: List[int] = field(default_factory=list)
+    sides: List[str] = field(default_factory=list)  # l / r
+    pdf_paths: List[Path] = field(default_factory=list)
+    image_paths: List[Path] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.page_indices)
 
-    @property
-    def label(self) -> str:
-        return f"p{self.page_index + 1:02d}_{self.side}"
+    def append(self, page_index: int, side: str, pdf_path: Path, image_path: Path) -> None:
+        self.page_indices.append(page_index)
+        self.sides.append(side)
+        self.pdf_paths.append(pdf_path)
+        self.image_paths.append(image_path)
+
+    def label(self, index: int) -> str:
+        return f"p{self.page_indices[index] + 1:02d}_{self.sides[index]}"
 
 
 def load_env(path: Path = DOTENV) -> None:
     if not path.exists():
         return
-    for line in path.read_text(encoding="utf-8").splitlines():
-        line = line.strip()
-        if not line or line.startswith("#") or "=" not in line:
-            continue
-        key, value = line.split("=", 1)
-        key = key.strip()
-        value = value.strip()
-        if key and key not in os.environ:
-            os.environ[key] = value
+    with path.open("rb") as handle:
+        if os.fstat(handle.fileno()).st_size == 0:
+            return  # mmap refuses empty files
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for raw in iter(mapped.readline, b""):
+                line = raw.decode("utf-8").strip()
+                if not line or line.startswith("#") or "=" not in line:
+                    continue
+                key, _, value = line.partition("=")
+                key = key.strip()
+                value = value.strip()
+                if key and key not in os.environ:
+                    os.environ[key] = value
 
 
 def _env_path(key: str, fallback: Optional[Path]) -> Optional[Path]:
@@ -85,9 +135,24 @@ def resolve_config() -> Config:
     yomitoku_cmd = (_env_path("YOMITOKU_CMD", ROOT / "yomitoku") or (ROOT / "yomitoku")).resolve()
     max_workers = int(_env_text("MAX_WORKERS", "4"))
     max_page_workers = int(_env_text("MAX_PAGE_WORKERS", "4"))
+    ocr_dpi_text = _env_text("OCR_DPI", "")
+    ocr_dpi = int(ocr_dpi_text) if ocr_dpi_text else None
+    split_results = _env_text("SPLIT_RESULTS", "1").lower() not in ("0", "false", "no")
     pdf_dir = pdf_dir.resolve() if pdf_dir else None
     pdf = pdf.resolve() if pdf else None
-    return Config(pdf, pdf_dir, prompt_path, output_dir, device, model, yomitoku_cmd, max_workers, max_page_workers)
+    return Config(
+        pdf,
+        pdf_dir,
+        prompt_path,
+        output_dir,
+        device,
+        model,
+        yomitoku_cmd,
+        max_workers,
+        max_page_workers,
+        ocr_dpi,
+        split_results,
+    )
 
 
 def iter_pdfs(single: Optional[Path], folder: Optional[Path]) -> List[Path]:
@@ -105,67 +170,254 @@ def iter_pdfs(single: Optional[Path], folder: Optional[Path]) -> List[Path]:
     return pdfs
 
 
+# Unicode-aware like str.isalnum(), so Japanese file names survive intact.
+NON_WORD_CHAR = re.compile(r"\W")
+
+
 def safe_name(path: Path) -> str:
-    text = path.stem
-    cleaned = "".join(ch if ch.isalnum() else "_" for ch in text)
-    cleaned = cleaned.strip("_")
+    cleaned = NON_WORD_CHAR.sub("_", path.stem).strip("_")
     return cleaned or "pdf"
 
 
-def split_pdf(pdf_path: Path, out_dir: Path) -> List[HalfPage]:
+def _render_workers(pdf_workers: int) -> int:
+    """Share of CPUs and physical memory for one PDF process's render pool."""
+    workers = os.cpu_count() or 1
+    try:
+        total_memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        total_memory = 0
+    if total_memory:
+        workers = min(workers, total_memory // RENDER_MEMORY_PER_WORKER)
+    return max(1, workers // pdf_workers)
+
+
+def start_render_pool(workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_renderer,
+    )
+
+
+def _half_clip(page: fitz.Page, side: str) -> fitz.Rect:
+    """Left or right half of the page as displayed (CropBox after /Rotate)."""
+    rect = page.rect
+    x_mid = rect.x0 + rect.width / 2.0
+    if side == "l":
+        return fitz.Rect(rect.x0, rect.y0, x_mid, rect.y1)
+    return fitz.Rect(x_mid, rect.y0, rect.x1, rect.y1)
+
+
+def _pdf_box(page: fitz.Page, clip: fitz.Rect) -> fitz.Rect:
+    """Map a rect in rendered page coordinates to PDF user space (bottom-left origin).
+
+    `clip` is relative to the rotated CropBox; PyMuPDF reports the CropBox with
+    PDF x values but y measured down from the MediaBox top.
+    """
+    unrotated = clip * page.derotation_matrix
+    crop = page.cropbox
+    top = page.mediabox.y1
+    return fitz.Rect(
+        crop.x0 + unrotated.x0,
+        top - (crop.y0 + unrotated.y1),
+        crop.x0 + unrotated.x1,
+        top - (crop.y0 + unrotated.y0),
+    )
+
+
+def split_pdf(
+    pdf_path: Path, out_dir: Path, render_pool: ProcessPoolExecutor, dpi: Optional[int] = None
+) -> HalfPageBatch:
     reader = PdfReader(str(pdf_path))
-    halves: List[HalfPage] = []
-    (out_dir / "pdf_pages").mkdir(parents=True, exist_ok=True)
+    doc = fitz.open(pdf_path)
+    halves = HalfPageBatch()
+    pages_dir = out_dir / "pdf_pages"
+    pages_dir.mkdir(parents=True, exist_ok=True)
 
-    for page_index, page in enumerate(reader.pages):
-        width = float(page.mediabox.width)
-        height = float(page.mediabox.height)
-        x_mid = width / 2.0
+    # Renders read the source PDF, so each half is queued as soon as it is
+    # recorded and the pool works while pypdf writes the later pages.
+    futures = []
+    try:
+        for page_index, page in enumerate(reader.pages):
+            fitz_page = doc[page_index]
 
-        for side, (x0, x1) in {"l": (0.0, x_mid), "r": (x_mid, width)}.items():
+            # One writer per source page; only the page boxes change between halves.
             writer = PdfWriter()
-            new_page = copy.deepcopy(page)
-            new_page.mediabox.lower_left = (x0, 0.0)
-            new_page.mediabox.upper_right = (x1, height)
-            writer.add_page(new_page)
-
-            half_pdf = out_dir / "pdf_pages" / f"{pdf_path.stem}_p{page_index + 1:02d}_{side.upper()}.pdf"
-            with half_pdf.open("wb") as handle:
-                writer.write(handle)
-
-            half_png = half_pdf.with_suffix(".png")
-            render_pdf_page(half_pdf, half_png)
-            halves.append(HalfPage(page_index, side, half_pdf, half_png))
+            half_page = writer.add_page(page)
+            for side in ("l", "r"):
+                box = _pdf_box(fitz_page, _half_clip(fitz_page, side))
+                half_page.mediabox.lower_left = (box.x0, box.y0)
+                half_page.mediabox.upper_right = (box.x1, box.y1)
+                half_page.cropbox = half_page.mediabox
+
+                half_pdf = pages_dir / f"{pdf_path.stem}_p{page_index + 1:02d}_{side.upper()}.pdf"
+                with half_pdf.open("wb") as handle:
+                    writer.write(handle)
+
+                image_path = half_pdf.with_suffix(".png")
+                halves.append(page_index, side, half_pdf, image_path)
+                futures.append(render_pool.submit(_render_half, str(pdf_path), page_index, side, dpi, str(image_path)))
+    finally:
+        doc.close()
+
+    for future in as_completed(futures):
+        future.result()
     return halves
 
 
-def render_pdf_page(pdf_path: Path, png_path: Path, dpi: int = 300) -> None:
-    doc = fitz.open(pdf_path)
-    try:
-        page = doc[0]
-        pix = page.get_pixmap(dpi=dpi)
-        pix.save(png_path)
-    finally:
-        doc.close()
+def _init_renderer() -> None:
+    """Give each render worker a small cache of open documents."""
+    global _DOC_CACHE
+    _DOC_CACHE = functools.lru_cache(maxsize=4)(fitz.open)
 
 
-def run_yomitoku(image_path: Path, page_dir: Path, device: str, yomitoku_cmd: Path) -> Path:
-    page_dir.mkdir(parents=True, exist_ok=True)
-    cmd = [
-        str(yomitoku_cmd),
-        str(image_path),
-        "-f",
-        "html",
-        "-o",
-        str(page_dir),
-        "-d",
-        device,
+def _choose_dpi(page: fitz.Page, clip: fitz.Rect) -> int:
+    """Pick a render DPI of at most OCR_DPI_MAX for one half page.
+
+    Halves whose text layer shows only normal-size print get OCR_DPI_MIN;
+    scans (no text layer) and small print keep the full 300. Very large
+    halves are capped, below OCR_DPI_MIN if need be, so their pixmap stays
+    around A4 at 300 DPI.
+    """
+    sizes = [
+        span["size"]
+        for block in page.get_text("dict", clip=clip, flags=TEXT_SIZE_FLAGS)["blocks"]
+        for line in block.get("lines", ())
+        for span in line["spans"]
+        if span["text"].strip()
     ]
-    subprocess.run(cmd, check=True)
-    html_files = sorted(page_dir.glob("*.html"), key=lambda p: p.stat().st_mtime, reverse=True)
-    if not html_files:
-        raise FileNotFoundError(f"No Yomitoku HTML in {page_dir}")
-    return html_files[0]
+    dpi = OCR_DPI_MAX if not sizes or min(sizes) < SMALL_PRINT_PT else OCR_DPI_MIN
+    area = clip.width * clip.height
+    if area <= 0:
+        return dpi  # degenerate box; there are no pixels to budget
+    cap = int(72.0 * math.sqrt(OCR_MAX_PIXELS / area))
+    return max(1, min(dpi, cap))
+
+
+def _render_half(pdf_path: str, page_index: int, side: str, dpi: Optional[int], out_png: str) -> None:
+    """Rasterize one half of a source page directly, without a half-page PDF."""
+    doc = _DOC_CACHE(pdf_path) if _DOC_CACHE is not None else fitz.open(pdf_path)
+    try:
+        page = doc[page_index]
+        clip = _half_clip(page, side)
+        zoom = (dpi or _choose_dpi(page, clip)) / 72.0
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+        pix.save(out_png)
+    finally:
+        if _DOC_CACHE is None:
+            doc.close()
+
+
+def _yomitoku_html_name(image_path: Path) -> str:
+    """The CLI's output name for one image: "<input dir>_<image stem>_p<page>.html"."""
+    return f"{image_path.parent.name}_{image_path.stem}_p1.html"
+
+
+def run_yomitoku_batch(
+    image_paths: Sequence[Path], page_dirs: Sequence[Path], work_dir: Path, device: str, yomitoku_cmd: Path
+) -> List[Union[Path, Exception]]:
+    """OCR every image with a single CLI start.
+
+    Returns, per image, its HTML moved into its page dir, or the error for an
+    image the CLI produced no HTML for. A failed CLI run raises.
+    """
+    with tempfile.TemporaryDirectory(prefix="yomitoku_", dir=work_dir) as tmp:
+        # Same directory name as the PNGs' real home, so the CLI names its HTML
+        # "pdf_pages_<stem>_p1.html" exactly as a direct per-image run would.
+        in_dir = Path(tmp) / "pdf_pages"
+        out_dir = Path(tmp) / "out"
+        in_dir.mkdir()
+        for image_path in image_paths:
+            try:
+                os.link(image_path, in_dir / image_path.name)
+            except OSError:
+                shutil.copyfile(image_path, in_dir / image_path.name)
+        cmd = [
+            str(yomitoku_cmd),
+            str(in_dir),
+            "-f",
+            "html",
+            "-o",
+            str(out_dir),
+            "-d",
+            device,
+        ]
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            stderr = result.stderr.decode("utf-8", errors="replace").strip()
+            raise RuntimeError(f"Yomitoku exited with {result.returncode}: {stderr[-2000:]}")
+        results: List[Union[Path, Exception]] = []
+        for image_path, page_dir in zip(image_paths, page_dirs):
+            html_file = out_dir / _yomitoku_html_name(in_dir / image_path.name)
+            if not html_file.exists():
+                results.append(FileNotFoundError(f"No Yomitoku HTML for {image_path.name} (expected {html_file.name})"))
+                continue
+            page_dir.mkdir(parents=True, exist_ok=True)
+            results.append(html_file.replace(page_dir / html_file.name))
+    return results
+
+
+def _init_yomitoku(device: str) -> None:
+    """Load the Yomitoku models once per OCR worker process."""
+    global _ANALYZER
+    from yomitoku import DocumentAnalyzer
+
+    _ANALYZER = DocumentAnalyzer(visualize=False, device=device)
+
+
+def _yomitoku_worker(image_path: str, page_dir: str) -> str:
+    """Run the in-process analyzer on one image and write its HTML like the CLI does."""
+    from yomitoku.data.functions import load_image
+
+    out_dir = Path(page_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    img = load_image(image_path)[0]
+    results, _, _ = _ANALYZER(img)
+    html_path = out_dir / _yomitoku_html_name(Path(image_path))
+    # The CLI only crops figures with --figure; export_html defaults to doing so.
+    results.to_html(str(html_path), img=img, export_figure=False)
+    return str(html_path)
+
+
+def yomitoku_importable() -> bool:
+    return importlib.util.find_spec("yomitoku") is not None
+
+
+def start_ocr_pool(cfg: Config, workers: int) -> Optional[ProcessPoolExecutor]:
+    """Start persistent Yomitoku workers when the library is importable here."""
+    if not yomitoku_importable():
+        return None
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_yomitoku,
+        initargs=(cfg.device,),
+    )
+
+
+def iter_ocr_results(
+    halves: HalfPageBatch, page_dirs: Sequence[Path], work_dir: Path, cfg: Config, ocr_pool: Optional[ProcessPoolExecutor]
+) -> Iterator[Tuple[int, Union[Path, Exception]]]:
+    """Yield (index, HTML path or error) for each half page as its OCR finishes."""
+    if ocr_pool is None:
+        # Without the library, start the CLI (and load its models) once per PDF.
+        # A missing HTML only fails its own half; only a failed run fails them all.
+        try:
+            html_paths = run_yomitoku_batch(halves.image_paths, page_dirs, work_dir, cfg.device, cfg.yomitoku_cmd)
+        except Exception as exc:
+            html_paths = [exc] * len(halves)
+        yield from enumerate(html_paths)
+        return
+    futures = {
+        ocr_pool.submit(_yomitoku_worker, str(image_path), str(page_dir)): index
+        for index, (image_path, page_dir) in enumerate(zip(halves.image_paths, page_dirs))
+    }
+    for future in as_completed(futures):
+        try:
+            result = Path(future.result())
+        except Exception as exc:
+            result = exc
+        yield futures[future], result
 
 
 def build_model(api_key: str, model_name: str):
@@ -173,49 +425,140 @@ def build_model(api_key: str, model_name: str):
     return genai.GenerativeModel(model_name)
 
 
-def upload_file(path: Path):
-    return genai.upload_file(path=str(path))
+def _prime_file_client() -> None:
+    """Reuse one File API discovery client (and its keep-alive connection) per thread.
+
+    google-generativeai only caches the discovery client thread-locally, yet
+    re-downloads the discovery document and opens a fresh HTTPS connection on
+    every upload because its ``_discovery_api`` marker is never set. Build the
+    thread-local client on a thread's first upload and set the marker so later
+    uploads skip that round trip. Older/newer SDK layouts are left untouched.
+    """
+    client = get_default_file_client()
+    local = getattr(client, "_local", None)
+    if local is None or not hasattr(client, "_setup_discovery_api"):
+        return
+    marker = getattr(client, "_discovery_api", object())
+    if marker is not None and marker is not True:
+        return  # the marker is missing, or this SDK version uses it for real
+    if getattr(local, "discovery_api", None) is None:
+        client._setup_discovery_api()
+        client._discovery_api = True
+
+
+def upload_file(path: Path, mime_type: Optional[str] = None):
+    _prime_file_client()
+    return genai.upload_file(path=str(path), mime_type=mime_type)
+
+
+def delete_upload(uploaded) -> None:
+    try:
+        genai.delete_file(uploaded.name)
+    except Exception:
+        pass
+
+
+def _discard_upload(future: Future) -> None:
+    """Done-callback that deletes an upload nobody is going to consume."""
+    if future.exception() is None:
+        delete_upload(future.result())
+
+
+# Finish reasons whose text is a usable (possibly length-capped) answer.
+GEMINI_FINISHED = ("STOP", "MAX_TOKENS")
+# What chunks report before the last one of a stream.
+GEMINI_STREAMING = "FINISH_REASON_UNSPECIFIED"
+
+
+def _finish_reason(response) -> Optional[str]:
+    """Block or finish reason of one streamed chunk (or the merged response)."""
+    feedback = getattr(response, "prompt_feedback", None)
+    if feedback is not None and feedback.block_reason:
+        return f"BLOCKED_{feedback.block_reason.name}"
+    if not response.candidates:
+        return None
+    return response.candidates[0].finish_reason.name
 
 
-def call_gemini(model, prompt_text: str, pdf_path: Path, html_path: Path) -> str:
-    uploads = []
+def call_gemini(model, prompt_file, pdf_file, html_path: Path) -> str:
+    """Ask Gemini about an already-uploaded half PDF; deletes both uploads."""
+    uploads = [pdf_file]
     try:
-        pdf_file = upload_file(pdf_path)
         html_file = upload_file(html_path)
-        uploads.extend([pdf_file, html_file])
+        uploads.append(html_file)
         response = model.generate_content(
-            [prompt_text, pdf_file, html_file],
+            [prompt_file, pdf_file, html_file],
+            stream=True,
             request_options={"timeout": 600},
         )
+        # Give up on the first chunk that says the answer is blocked or cut off;
+        # the SDK merges the chunks into `response` as they arrive.
+        for chunk in response:
+            reason = _finish_reason(chunk)
+            if reason is not None and reason != GEMINI_STREAMING and reason not in GEMINI_FINISHED:
+                raise RuntimeError(f"Gemini stopped with finish_reason={reason}")
+        reason = _finish_reason(response) or "NO_CANDIDATE"
+        if reason not in GEMINI_FINISHED:
+            raise RuntimeError(f"Gemini stopped with finish_reason={reason}")
         return response.text or ""
     finally:
         for uploaded in uploads:
-            try:
-                genai.delete_file(uploaded.name)
-            except Exception:
-                pass
-
-
-CODE_FENCE = re.compile(r"```(?:json|javascript|js)?\s*([\s\S]+?)\s*```", re.IGNORECASE)
+            delete_upload(uploaded)
+
+
+CODE_FENCE = "```"
+CODE_FENCE_LANGS = ("json", "javascript", "js")
+# orjson silently turns integers outside 64 bits into floats.
+LONG_DIGITS = re.compile(r"\d{19}")
+
+
+def _strip_code_fence(text: str) -> str:
+    """Return the body of the first non-empty ``` block (optionally tagged json/js), if any."""
+    start = text.find(CODE_FENCE)
+    while start >= 0:
+        end = text.find(CODE_FENCE, start + len(CODE_FENCE))
+        if end < 0:
+            break
+        body = text[start + len(CODE_FENCE):end]
+        for lang in CODE_FENCE_LANGS:
+            if body[: len(lang)].lower() == lang:
+                body = body[len(lang):]
+                break
+        body = body.strip()
+        if body:
+            return body
+        start = end  # an empty block; its closing fence may open the next one
+    return text
+
+
+def _decode_leading_json(candidate: str) -> Optional[object]:
+    """Parse the JSON value at the start of `candidate`, ignoring trailing text."""
+    if orjson is not None and not LONG_DIGITS.search(candidate):
+        try:
+            return orjson.loads(candidate)
+        except orjson.JSONDecodeError:
+            pass  # trailing prose or non-strict JSON; let raw_decode have a go
+    try:
+        parsed, _ = json.JSONDecoder().raw_decode(candidate)
+        return parsed
+    except json.JSONDecodeError:
+        return None
 
 
 def _extract_json_payload(payload: str) -> tuple[str, Optional[object]]:
     """Return cleaned text plus parsed JSON if possible."""
-    text = payload.strip()
-    match = CODE_FENCE.search(text)
-    if match:
-        text = match.group(1).strip()
+    text = _strip_code_fence(payload.strip())
     text = text.lstrip("\ufeff").lstrip()
-    start_index = next((idx for idx, ch in enumerate(text) if ch in "{["), None)
-    candidate = text[start_index:] if start_index is not None else text
+    starts = [idx for idx in (text.find("{"), text.find("[")) if idx >= 0]
+    candidate = text[min(starts):] if starts else text
     if not candidate:
         return "", None
-    decoder = json.JSONDecoder()
-    try:
-        parsed, _ = decoder.raw_decode(candidate)
-        return candidate.strip(), parsed
-    except json.JSONDecodeError:
-        return candidate.strip(), None
+    return candidate.strip(), _decode_leading_json(candidate)
+
+
+def _lead_with_year(item: dict, year_tag: str) -> dict:
+    item.pop("year", None)
+    return {"year": year_tag, **item}
 
 
 def _attach_year(parsed: object, year_tag: Optional[str]) -> object:
@@ -223,71 +566,194 @@ def _attach_year(parsed: object, year_tag: Optional[str]) -> object:
     if not year_tag:
         return parsed
     if isinstance(parsed, dict):
-        remainder = {key: value for key, value in parsed.items() if key != "year"}
-        ordered = {"year": year_tag}
-        ordered.update(remainder)
-        return ordered
+        return _lead_with_year(parsed, year_tag)
     if isinstance(parsed, list):
-        result = []
-        for item in parsed:
-            if isinstance(item, dict):
-                remainder = {key: value for key, value in item.items() if key != "year"}
-                ordered = {"year": year_tag}
-                ordered.update(remainder)
-                result.append(ordered)
-            else:
-                result.append(item)
-        return result
+        return [_lead_with_year(item, year_tag) if isinstance(item, dict) else item for item in parsed]
     return parsed
 
 
-def write_json(target: Path, payload: str, year_tag: Optional[str]) -> None:
-    target.parent.mkdir(parents=True, exist_ok=True)
-    cleaned, parsed = _extract_json_payload(payload)
-    if parsed is not None:
-        parsed = _attach_year(parsed, year_tag)
-        target.write_text(json.dumps(parsed, ensure_ascii=False, indent=2), encoding="utf-8")
-        return
-    fallback = cleaned or payload.strip()
-    if year_tag:
-        wrapped = {"year": year_tag, "raw": fallback}
-        target.write_text(json.dumps(wrapped, ensure_ascii=False, indent=2), encoding="utf-8")
-        return
-    target.write_text(fallback, encoding="utf-8")
+def _has_non_finite(value: object) -> bool:
+    if isinstance(value, float):
+        return not math.isfinite(value)
+    if isinstance(value, dict):
+        return any(map(_has_non_finite, value.values()))
+    if isinstance(value, list):
+        return any(map(_has_non_finite, value))
+    return False
 
 
-def process_half_page(half: HalfPage, pdf_path: Path, cfg: Config, prompt_text: str, model, year_tag: str) -> None:
-    """Process a single half page: Yomitoku OCR + Gemini API call."""
-    safe = safe_name(pdf_path)
-    pdf_out = cfg.output_dir / safe
-    page_dir = pdf_out / half.label
+def dump_json(data: object, indent: bool = True) -> bytes:
+    """Serialize JSON as UTF-8 (pretty or one line), via orjson when it is installed.
+
+    orjson spells some float exponents differently from the stdlib (1.5e-07
+    vs 1.5e-7) but parses back to the same values. NaN and Infinity, which
+    orjson would write as null, go through the stdlib.
+    """
+    if orjson is not None and not _has_non_finite(data):
+        try:
+            return orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0)
+        except orjson.JSONEncodeError:
+            pass  # e.g. integers beyond 64 bits or non-str keys; the stdlib handles those
+    if indent:
+        return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def results_log_path(pdf_out: Path, pdf_path: Path) -> Path:
+    # Named by stem: PDFs whose safe_name collides share pdf_out.
+    return pdf_out / f"{pdf_path.stem}{RESULTS_LOG_SUFFIX}"
+
 
-    html_path = run_yomitoku(half.image_path, page_dir, cfg.device, cfg.yomitoku_cmd)
-    gemini_text = call_gemini(model, prompt_text, half.pdf_path, html_path)
-    json_target = pdf_out / f"{pdf_path.stem}_{half.label}.json"
-    write_json(json_target, gemini_text, year_tag)
-    print(f"[DONE] {pdf_path.name} -> {half.label} -> {json_target}")
+def open_results_log(path: Path) -> int:
+    """Open a fresh append-only NDJSON log shared by every half page of a PDF."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND | getattr(os, "O_BINARY", 0)
+    return os.open(path, flags, 0o644)
 
 
-def process_pdf(pdf_path: Path, cfg: Config, prompt_text: str, model) -> None:
-    """Process a PDF: split into halves and process them in parallel."""
+def append_result(log_fd: int, target: Path, payload: str, year_tag: Optional[str]) -> None:
+    """Record one Gemini answer as a single O_APPEND write, so lines never interleave."""
+    cleaned, parsed = _extract_json_payload(payload)
+    if parsed is not None:
+        record = {"target": target.name, "json": _attach_year(parsed, year_tag)}
+    else:
+        fallback = cleaned or payload.strip()
+        if year_tag:
+            record = {"target": target.name, "json": {"year": year_tag, "raw": fallback}}
+        else:
+            record = {"target": target.name, "text": fallback}
+    line = dump_json(record, indent=False) + b"\n"
+    if os.write(log_fd, line) != len(line):
+        # End the fragment so the next answer still starts on its own line.
+        os.write(log_fd, b"\n")
+        raise OSError(f"Short write while recording {target.name}")
+
+
+def materialize_results(log_path: Path) -> None:
+    """Write the per-half-page JSON files recorded in an NDJSON results log."""
+    with log_path.open("rb") as handle:
+        for number, line in enumerate(handle, 1):
+            record = _decode_leading_json(line.decode("utf-8", errors="replace"))
+            if not isinstance(record, dict) or "target" not in record:
+                print(f"[ERROR] {log_path}:{number} is not a complete record; skipped")
+                continue
+            target = log_path.parent / record["target"]
+            if "json" in record:
+                target.write_bytes(dump_json(record["json"]))
+            else:
+                target.write_text(record["text"], encoding="utf-8")
+
+
+def process_half_page(
+    label: str,
+    pdf_path: Path,
+    cfg: Config,
+    prompt_file,
+    model,
+    year_tag: str,
+    html_path: Path,
+    pdf_upload: Future,
+    log_fd: int,
+) -> None:
+    """Gemini stage for a single half page whose OCR HTML is ready."""
+    pdf_out = cfg.output_dir / safe_name(pdf_path)
+    gemini_text = call_gemini(model, prompt_file, pdf_upload.result(), html_path)
+    json_target = pdf_out / f"{pdf_path.stem}_{label}.json"
+    append_result(log_fd, json_target, gemini_text, year_tag)
+    print(f"[DONE] {pdf_path.name} -> {label} -> {results_log_path(pdf_out, pdf_path)}")
+
+
+def process_pdf(
+    pdf_path: Path,
+    cfg: Config,
+    prompt_file,
+    model,
+    ocr_pool: Optional[ProcessPoolExecutor],
+    render_pool: ProcessPoolExecutor,
+) -> None:
+    """Process a PDF: split into halves, then pipeline OCR, uploads and Gemini.
+
+    Each stage has its own pool so a half page is handed to Gemini as soon as
+    its OCR finishes, while other halves are still being recognised. Half PDFs
+    are uploaded at most ``cfg.max_page_workers`` halves ahead of the OCR. With the
+    CLI fallback all halves are recognised by one Yomitoku run instead.
+    Answers are appended to ``<stem>_results.jsonl`` and, unless
+    ``cfg.split_results`` is off, split into the per-half JSON files once
+    every half has finished.
+    """
     safe = safe_name(pdf_path)
     pdf_out = cfg.output_dir / safe
-    halves = split_pdf(pdf_path, pdf_out)
+    halves = split_pdf(pdf_path, pdf_out, render_pool, cfg.ocr_dpi)
+    labels = [halves.label(index) for index in range(len(halves))]
     year_tag = pdf_path.stem
+    log_path = results_log_path(pdf_out, pdf_path)
+    log_fd = open_results_log(log_path)
+    try:
+        with (
+            ThreadPoolExecutor(max_workers=cfg.max_page_workers) as upload_executor,
+            ThreadPoolExecutor(max_workers=cfg.max_page_workers) as gemini_executor,
+        ):
+            # The half PDF does not depend on OCR, so upload it while OCR runs,
+            # but stay within max_page_workers halves of the OCR frontier.
+            window = cfg.max_page_workers
+            pdf_uploads = {
+                index: upload_executor.submit(upload_file, halves.pdf_paths[index])
+                for index in range(min(window, len(halves)))
+            }
+            page_dirs = [pdf_out / label for label in labels]
+            gemini_futures = {}
+            ocr_results = iter_ocr_results(halves, page_dirs, pdf_out, cfg, ocr_pool)
+            for done, (index, html_path) in enumerate(ocr_results, 1):
+                # OCR can finish out of order, so the finished half may be past the window.
+                for ahead in (index, *range(done, min(done + window, len(halves)))):
+                    if ahead not in pdf_uploads:
+                        pdf_uploads[ahead] = upload_executor.submit(upload_file, halves.pdf_paths[ahead])
+                if isinstance(html_path, Exception):
+                    pdf_uploads[index].add_done_callback(_discard_upload)
+                    print(f"[ERROR] {pdf_path.name} -> {labels[index]} failed: {html_path}")
+                    continue
+                future = gemini_executor.submit(
+                    process_half_page,
+                    labels[index],
+                    pdf_path,
+                    cfg,
+                    prompt_file,
+                    model,
+                    year_tag,
+                    html_path,
+                    pdf_uploads[index],
+                    log_fd,
+                )
+                gemini_futures[future] = index
+
+            for future in as_completed(gemini_futures):
+                try:
+                    future.result()
+                except Exception as exc:
+                    print(f"[ERROR] {pdf_path.name} -> {labels[gemini_futures[future]]} failed: {exc}")
+    finally:
+        os.close(log_fd)
+    if cfg.split_results:
+        materialize_results(log_path)
+
+
+def _init_pdf_worker(api_key: str, cfg: Config, prompt_name: str, ocr_workers: int, render_workers: int) -> None:
+    """Build the Gemini model, prompt handle, OCR and render workers once per PDF process."""
+    global _MODEL, _PROMPT_FILE, _OCR_POOL, _RENDER_POOL
+    _MODEL = build_model(api_key, cfg.model)
+    _PROMPT_FILE = genai.get_file(prompt_name)
+    _OCR_POOL = start_ocr_pool(cfg, ocr_workers)
+    _RENDER_POOL = start_render_pool(render_workers)
+    # A pool worker joins its child processes before interpreter shutdown would
+    # stop these executors, so stop them first (ahead of the call queues' own
+    # exit finalizers at priority 10) or the worker never exits.
+    for pool in (_OCR_POOL, _RENDER_POOL):
+        if pool is not None:
+            multiprocessing.util.Finalize(pool, pool.shutdown, exitpriority=20)
 
-    # Process half pages in parallel
-    with ThreadPoolExecutor(max_workers=cfg.max_page_workers) as executor:
-        futures = {
-            executor.submit(process_half_page, half, pdf_path, cfg, prompt_text, model, year_tag): half
-            for half in halves
-        }
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception as exc:
-                half = futures[future]
-                print(f"[ERROR] {pdf_path.name} -> {half.label} failed: {exc}")
+
+def _pdf_worker(pdf_path: Path, cfg: Config) -> None:
+    process_pdf(pdf_path, cfg, _PROMPT_FILE, _MODEL, _OCR_POOL, _RENDER_POOL)
 
 
 def main(argv: Optional[Sequence[str]] = None) -> None:
@@ -301,6 +767,12 @@ def main(argv: Optional[Sequence[str]] = None) -> None:
     parser.add_argument("--yomitoku", type=Path, default=None)
     parser.add_argument("--max-workers", type=int, default=None, help="Max parallel PDFs")
     parser.add_argument("--max-page-workers", type=int, default=None, help="Max parallel pages per PDF")
+    parser.add_argument("--ocr-dpi", type=int, default=None, help="Fixed render DPI (default: adaptive 200-300)")
+    parser.add_argument(
+        "--no-split-results",
+        action="store_true",
+        help="Keep answers in <stem>_results.jsonl only, no per-half JSON files",
+    )
     args = parser.parse_args(argv)
 
     cfg = resolve_config()
@@ -322,6 +794,10 @@ def main(argv: Optional[Sequence[str]] = None) -> None:
         cfg.max_workers = args.max_workers
     if args.max_page_workers is not None:
         cfg.max_page_workers = args.max_page_workers
+    if args.ocr_dpi is not None:
+        cfg.ocr_dpi = args.ocr_dpi
+    if args.no_split_results:
+        cfg.split_results = False
 
     pdfs = iter_pdfs(cfg.pdf, cfg.pdf_dir)
     api_key = os.environ.get("GEMINI_API_KEY")
@@ -329,23 +805,35 @@ def main(argv: Optional[Sequence[str]] = None) -> None:
         raise EnvironmentError("GEMINI_API_KEY must be stored in .env")
 
     cfg.output_dir.mkdir(parents=True, exist_ok=True)
-    prompt_text = cfg.prompt_path.read_text(encoding="utf-8")
-    model = build_model(api_key, cfg.model)
+    genai.configure(api_key=api_key)
+    # Shared by every generate_content call of this run; deleted at the end.
+    prompt_file = upload_file(cfg.prompt_path, mime_type="text/plain")
 
     print(f"Processing {len(pdfs)} PDF(s) with max_workers={cfg.max_workers}, max_page_workers={cfg.max_page_workers}")
-
-    # Process multiple PDFs in parallel
-    with ThreadPoolExecutor(max_workers=cfg.max_workers) as executor:
-        futures = {
-            executor.submit(process_pdf, pdf, cfg, prompt_text, model): pdf
-            for pdf in pdfs
-        }
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception as exc:
-                pdf = futures[future]
-                print(f"[ERROR] Processing {pdf.name} failed: {exc}")
+    if not yomitoku_importable():
+        print(f"Yomitoku library not importable; using CLI {cfg.yomitoku_cmd}")
+
+    # Process multiple PDFs in parallel, one interpreter per PDF. The Yomitoku
+    # and render workers are split between them so the run loads max_page_workers
+    # models and renders on at most cpu_count processes.
+    pdf_workers = min(cfg.max_workers, len(pdfs))
+    ocr_workers = max(1, cfg.max_page_workers // pdf_workers)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=pdf_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_pdf_worker,
+            initargs=(api_key, cfg, prompt_file.name, ocr_workers, _render_workers(pdf_workers)),
+        ) as executor:
+            futures = {executor.submit(_pdf_worker, pdf, cfg): pdf for pdf in pdfs}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as exc:
+                    pdf = futures[future]
+                    print(f"[ERROR] Processing {pdf.name} failed: {exc}")
+    finally:
+        delete_upload(prompt_file)
 
 
 if __name__ == "__main__":